@@ -2,81 +2,462 @@ import streamlit as st
 from streamlit_webrtc import webrtc_streamer, WebRtcMode
 import speech_recognition as sr
 import datetime
+import logging
+import time
 import numpy as np
+import pandas as pd
 import queue
 import threading
+import os
+import re
+import shutil
+import tempfile
 import av
-from transformers import pipeline
+import onnxruntime as ort
+from collections import OrderedDict, deque
+from faster_whisper import WhisperModel
+from transformers import AutoTokenizer, pipeline
+from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
 
-# Initialize queues and sentiment analyzer
-audio_queue = queue.Queue()
-result_queue = queue.Queue()
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+# Sentiment model is exported to ONNX and INT8-quantized once, then reused
+SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUANTIZED_MODEL_DIR = os.path.join(BASE_DIR, "onnx_distilbert_sst2_int8")
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+QUANTIZED_MODEL_FILES = (QUANTIZED_MODEL_FILE, "config.json", "tokenizer_config.json")
+
+def is_quantized_model_complete():
+    return all(
+        os.path.isfile(os.path.join(QUANTIZED_MODEL_DIR, name)) for name in QUANTIZED_MODEL_FILES
+    )
+
+# Both models are process-wide and shared by every session, so one CPU budget of
+# physical cores (logical / 2 on SMT machines) is split between them rather than
+# each claiming every core. Whisper decodes are the heavier load and get the larger
+# share; concurrent sessions queue on the same models instead of adding threads.
+PHYSICAL_CORES = max(1, (os.cpu_count() or 2) // 2)
+SENTIMENT_THREADS = max(1, PHYSICAL_CORES // 4)
+TRANSCRIBER_THREADS = max(1, PHYSICAL_CORES - SENTIMENT_THREADS)
+
+def export_quantized_model():
+    # Export into a temporary directory and move it into place only once complete,
+    # so a crashed export is retried on the next start instead of half-loaded
+    export_dir = tempfile.mkdtemp(
+        prefix=os.path.basename(QUANTIZED_MODEL_DIR) + ".tmp-", dir=BASE_DIR
+    )
+    try:
+        quantize_model(export_dir)
+        shutil.rmtree(QUANTIZED_MODEL_DIR, ignore_errors=True)
+        os.replace(export_dir, QUANTIZED_MODEL_DIR)
+    except BaseException:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        raise
+
+def quantize_model(save_dir):
+    model = ORTModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    # Dynamic quantization: per-channel INT8 weights, activations scaled at runtime.
+    # Gather is included so the word embedding table is stored as INT8 as well.
+    qconfig = AutoQuantizationConfig.avx512_vnni(
+        is_static=False,
+        per_channel=True,
+        operators_to_quantize=["MatMul", "Attention", "Gather"]
+    )
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    model.config.save_pretrained(save_dir)
+    AutoTokenizer.from_pretrained(SENTIMENT_MODEL).save_pretrained(save_dir)
 
 @st.cache_resource
 def load_sentiment_analyzer():
-    return pipeline("sentiment-analysis")
+    if not is_quantized_model_complete():
+        export_quantized_model()
+    session_options = ort.SessionOptions()
+    session_options.intra_op_num_threads = SENTIMENT_THREADS
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    model = ORTModelForSequenceClassification.from_pretrained(
+        QUANTIZED_MODEL_DIR,
+        file_name=QUANTIZED_MODEL_FILE,
+        provider="CPUExecutionProvider"
+    )
+    tokenizer = AutoTokenizer.from_pretrained(QUANTIZED_MODEL_DIR)
+    return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
 
 sentiment_analyzer = load_sentiment_analyzer()
 
+# Local speech-to-text; buffered speech is decoded once the speaker pauses
+SAMPLE_RATE = 16000
+MIN_SPEECH_SECONDS = 1.0
+MAX_SPEECH_SECONDS = 30.0
+SILENCE_SECONDS = 0.3
+SILENCE_RMS = 300
+
+# Bounded ring buffer of audio frames; oldest frames drop first. It holds twice the
+# longest utterance so a full-length decode can run without losing audio.
+AUDIO_FRAME_SECONDS = 0.02
+AUDIO_QUEUE_MAXLEN = int(2 * MAX_SPEECH_SECONDS / AUDIO_FRAME_SECONDS)
+DROP_LOG_INTERVAL = 50
+
+@st.cache_resource
+def load_transcriber():
+    # num_workers=1 serializes transcribe calls from all session workers
+    return WhisperModel(
+        "small.en",
+        device="cpu",
+        compute_type="int8",
+        cpu_threads=TRANSCRIBER_THREADS,
+        num_workers=1
+    )
+
+transcriber = load_transcriber()
+
+@st.cache_resource
+def load_recognizer():
+    return sr.Recognizer()
+
+recognizer = load_recognizer()
+
 # Risk keywords for escalation
 RISK_KEYWORDS = [
     "suicide", "kill", "hurt", "harm", "die", "end my life",
     "self harm", "cut myself", "overdose", "pills"
 ]
 
+def build_risk_matcher():
+    # Single pass over the text for all keywords; regex alternation if pyahocorasick is missing
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for keyword in RISK_KEYWORDS:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text.lower()), None) is not None
+    # Case-insensitive search scans the original text without a lowercased copy
+    pattern = re.compile("|".join(map(re.escape, RISK_KEYWORDS)), re.IGNORECASE)
+    return lambda text: pattern.search(text) is not None
+
+contains_risk_keyword = build_risk_matcher()
+
+# Risk results are memoized per text, shared by the fallback path and the workers
+RISK_CACHE_SIZE = 2048
+
+@st.cache_resource
+def load_risk_cache():
+    return OrderedDict(), threading.Lock()
+
+risk_cache, risk_cache_lock = load_risk_cache()
+
+# Pending utterances are scored in one batch once it fills up or ages out
+RISK_BATCH_SIZE = 8
+RISK_BATCH_TIMEOUT = 0.25
+WORKER_POLL_INTERVAL = 0.02
+# Idle workers (no audio for this long) exit; the next rerun restarts them
+WORKER_IDLE_TIMEOUT = 60.0
+# While recording, the status and history sections refresh this often
+RERUN_INTERVAL = 1.0
+
+# Conversation history is stored column-wise: one list per field
+CONVERSATION_COLUMNS = ("timestamp", "speaker", "text", "risk_level", "sentiment_score")
+RISK_COLORS = {"High": "background-color: #fee", "Medium": "background-color: #ffd"}
+
 def initialize_session_state():
     if 'conversations' not in st.session_state:
-        st.session_state.conversations = []
+        st.session_state.conversations = {column: [] for column in CONVERSATION_COLUMNS}
     if 'speaker_count' not in st.session_state:
         st.session_state.speaker_count = 0
+    if 'speakers' not in st.session_state:
+        st.session_state.speakers = ()
     if 'risk_level' not in st.session_state:
         st.session_state.risk_level = "Normal"
     if 'current_text' not in st.session_state:
         st.session_state.current_text = ""
     if 'is_recording' not in st.session_state:
         st.session_state.is_recording = False
-    if 'audio_frames_received' not in st.session_state:
-        st.session_state.audio_frames_received = False
     if 'using_fallback' not in st.session_state:
         st.session_state.using_fallback = False
+    if 'fallback_audio_id' not in st.session_state:
+        st.session_state.fallback_audio_id = None
+    if 'transcription_worker' not in st.session_state:
+        st.session_state.transcription_worker = TranscriptionWorker()
 
 def detect_risk_level(text):
-    sentiment_result = sentiment_analyzer(text)[0]
+    return detect_risk_levels([text])[0]
+
+def detect_risk_levels(texts):
+    results = [detect_keyword_risk(text) or lookup_cached_risk(text) for text in texts]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        sentiment_results = sentiment_analyzer(
+            [texts[i] for i in misses], batch_size=len(misses), truncation=True, padding=True
+        )
+        for i, sentiment_result in zip(misses, sentiment_results):
+            results[i] = classify_sentiment(sentiment_result)
+            store_cached_risk(texts[i], results[i])
+    return results
+
+def lookup_cached_risk(text):
+    with risk_cache_lock:
+        result = risk_cache.get(text)
+        if result is not None:
+            risk_cache.move_to_end(text)
+        return result
+
+def store_cached_risk(text, result):
+    with risk_cache_lock:
+        risk_cache[text] = result
+        risk_cache.move_to_end(text)
+        if len(risk_cache) > RISK_CACHE_SIZE:
+            risk_cache.popitem(last=False)
+
+def detect_keyword_risk(text):
+    # Cheap checks that decide the risk level without running the sentiment model
+    if contains_risk_keyword(text):
+        return "High", 1.0
+    if len(text.strip()) < 3:
+        return "Normal", 0.0
+    return None
+
+def classify_sentiment(sentiment_result):
     sentiment_score = sentiment_result['score']
     sentiment_label = sentiment_result['label']
-    
-    text_lower = text.lower()
-    for keyword in RISK_KEYWORDS:
-        if keyword in text_lower:
-            return "High", sentiment_score
 
-    if sentiment_label == 'NEGATIVE' and sentiment_score > 0.8:
-        return "Medium", sentiment_score
-    elif sentiment_label == 'NEGATIVE' and sentiment_score > 0.95:
+    if sentiment_label == 'NEGATIVE' and sentiment_score > 0.95:
         return "High", sentiment_score
+    elif sentiment_label == 'NEGATIVE' and sentiment_score > 0.8:
+        return "Medium", sentiment_score
     
     return "Normal", sentiment_score
 
+def append_conversation(entry):
+    conversations = st.session_state.conversations
+    for column in CONVERSATION_COLUMNS:
+        conversations[column].append(entry[column])
+
+def highlight_risk(risk_levels):
+    return [RISK_COLORS.get(risk_level, "") for risk_level in risk_levels]
+
 def save_conversation(conversations):
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"conversation_{timestamp}.txt"
     
-    with open(filename, "w") as f:
-        for conv in conversations:
-            f.write(f"{conv['timestamp']} - {conv['speaker']}: {conv['text']}\n")
-            f.write(f"Risk Level: {conv['risk_level']} - Sentiment: {conv['sentiment_score']:.2f}\n\n")
+    lines = [
+        f"{conv_timestamp} - {speaker}: {text}\n"
+        f"Risk Level: {risk_level} - Sentiment: {sentiment_score:.2f}\n\n"
+        for conv_timestamp, speaker, text, risk_level, sentiment_score in zip(
+            *(conversations[column] for column in CONVERSATION_COLUMNS)
+        )
+    ]
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("".join(lines))
     return filename
 
-def process_audio(frame):
-    sound = frame.to_ndarray()
-    audio_queue.put(sound)
-    st.session_state.audio_frames_received = True
-    return av.AudioFrame.from_ndarray(sound, layout='mono')
+def transcribe_speech(samples):
+    segments, _ = transcriber.transcribe(
+        samples.astype(np.float32) / 32768.0,
+        language="en",
+        beam_size=1,
+        vad_filter=True
+    )
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+class TranscriptionWorker:
+    # Per-session pipeline: the WebRTC callback feeds audio_queue, a background
+    # thread runs speech-to-text and batched risk scoring, and the Streamlit
+    # script drains finished entries from result_queue
+
+    def __init__(self):
+        self.audio_queue = deque(maxlen=AUDIO_QUEUE_MAXLEN)
+        self.result_queue = queue.Queue()
+        self.audio_received = threading.Event()
+        self.stream_ended = threading.Event()
+        self.dropped_frames = 0
+        # Set by the script thread each rerun; stamped onto audio as it arrives
+        self.speaker = None
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        # Resamplers lock onto their first frame's format, so each stream gets its own
+        self.resampler = None
+        self.resampler_lock = threading.Lock()
+        self.reset_buffers()
+
+    def reset_buffers(self):
+        self.reset_speech()
+        self.pending = []
+        self.pending_since = 0.0
+
+    def reset_speech(self):
+        # Chunks of the current utterance; only collected once speech has started
+        self.speech_chunks = []
+        self.speech_samples = 0
+        self.trailing_silence = 0
+        self.speech_speaker = None
+
+    def ensure_running(self):
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def end_stream(self):
+        with self.resampler_lock:
+            self.resampler = None
+        self.audio_received.clear()
+        self.stream_ended.set()
+
+    def resample(self, frame):
+        # WebRTC delivers 48 kHz frames; whisper expects 16 kHz mono s16
+        with self.resampler_lock:
+            if self.resampler is None:
+                self.resampler = av.AudioResampler(format='s16', layout='mono', rate=SAMPLE_RATE)
+            try:
+                return self.resampler.resample(frame)
+            except ValueError:
+                # Input format changed mid-stream; start over with a fresh resampler
+                self.resampler = av.AudioResampler(format='s16', layout='mono', rate=SAMPLE_RATE)
+                return self.resampler.resample(frame)
+
+    def process_audio(self, frame):
+        # Flat 16 kHz int16 PCM for the transcriber; the frame itself is returned untouched
+        speaker = self.speaker
+        for resampled in self.resample(frame):
+            sound = np.ascontiguousarray(resampled.to_ndarray().reshape(-1), dtype=np.int16)
+            if len(self.audio_queue) == AUDIO_QUEUE_MAXLEN:
+                # The deque evicts the oldest frame on append; make the loss visible
+                self.dropped_frames += 1
+                if self.dropped_frames % DROP_LOG_INTERVAL == 1:
+                    logger.warning(
+                        "Audio queue full; %d frames dropped so far", self.dropped_frames
+                    )
+            self.audio_queue.append((speaker, sound))
+        self.audio_received.set()
+        return frame
+
+    def run(self):
+        last_audio = time.monotonic()
+        while True:
+            try:
+                received = self.step()
+            except Exception:
+                logger.exception("Transcription worker failed; dropping buffered audio")
+                self.reset_buffers()
+                received = False
+
+            now = time.monotonic()
+            if received:
+                last_audio = now
+                continue
+            if (now - last_audio >= WORKER_IDLE_TIMEOUT
+                    and not self.speech_chunks and not self.pending):
+                return
+            time.sleep(WORKER_POLL_INTERVAL)
+
+    def step(self):
+        stream_ended = self.stream_ended.is_set()
+        self.stream_ended.clear()
+        frames = []
+        while True:
+            try:
+                frames.append(self.audio_queue.popleft())
+            except IndexError:
+                break
+
+        for speaker, sound in frames:
+            # A new speaker closes the previous speaker's utterance
+            if speaker != self.speech_speaker:
+                if self.speech_chunks:
+                    self.decode_speech()
+                self.speech_speaker = speaker
+            self.add_speech(sound)
+            if self.is_speech_finished():
+                self.decode_speech()
+
+        if stream_ended:
+            # Finish what was said before the stream stopped; nothing carries over
+            if self.speech_chunks:
+                self.decode_speech()
+            self.reset_speech()
+
+        self.flush_if_due()
+        return bool(frames)
+
+    def add_speech(self, sound):
+        rms = np.sqrt(np.mean(sound.astype(np.float32) ** 2)) if sound.size else 0.0
+        if rms >= SILENCE_RMS:
+            self.trailing_silence = 0
+        elif not self.speech_chunks:
+            # Silence before any speech is dropped rather than buffered
+            return
+        else:
+            self.trailing_silence += sound.size
+        self.speech_chunks.append(sound)
+        self.speech_samples += sound.size
+
+    def is_speech_finished(self):
+        if self.speech_samples >= MAX_SPEECH_SECONDS * SAMPLE_RATE:
+            return True
+        return (self.speech_samples >= MIN_SPEECH_SECONDS * SAMPLE_RATE
+                and self.trailing_silence >= SILENCE_SECONDS * SAMPLE_RATE)
+
+    def decode_speech(self):
+        # A decode can take seconds; don't let it push the batch past its deadline
+        self.flush_if_due()
+        samples = np.concatenate(self.speech_chunks)
+        speaker = self.speech_speaker
+        self.reset_speech()
+        self.speech_speaker = speaker
+        text = transcribe_speech(samples)
+        if not text:
+            return
+        entry = {
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "speaker": speaker,
+            "text": text
+        }
+        keyword_result = detect_keyword_risk(text)
+        if keyword_result is not None:
+            # Keyword hits need no model, so report them right away; flushing
+            # first keeps the history in the order things were said
+            if self.pending:
+                self.flush_pending()
+            entry['risk_level'], entry['sentiment_score'] = keyword_result
+            self.result_queue.put(entry)
+            return
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.append(entry)
+
+    def flush_if_due(self):
+        if self.pending and (len(self.pending) >= RISK_BATCH_SIZE
+                             or time.monotonic() - self.pending_since >= RISK_BATCH_TIMEOUT):
+            self.flush_pending()
+
+    def flush_pending(self):
+        pending, self.pending = self.pending, []
+        risk_results = detect_risk_levels([entry['text'] for entry in pending])
+        for entry, (risk_level, sentiment_score) in zip(pending, risk_results):
+            entry['risk_level'] = risk_level
+            entry['sentiment_score'] = sentiment_score
+            self.result_queue.put(entry)
+
+    def collect_transcriptions(self):
+        while True:
+            try:
+                entry = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            append_conversation(entry)
 
 def process_fallback_audio(audio_data, speaker):
     try:
-        recognizer = sr.Recognizer()
-        audio = sr.AudioData(audio_data.getvalue(), sample_rate=44100, sample_width=2)
+        # st.audio_input returns a WAV upload; AudioFile reads its real sample rate
+        with sr.AudioFile(audio_data) as source:
+            audio = recognizer.record(source)
         text = recognizer.recognize_google(audio)
         if text:
             risk_level, sentiment_value = detect_risk_level(text)
@@ -87,12 +468,57 @@ def process_fallback_audio(audio_data, speaker):
                 "risk_level": risk_level,
                 "sentiment_score": sentiment_value
             }
-            st.session_state.conversations.append(conversation_entry)
+            append_conversation(conversation_entry)
             return text, risk_level, sentiment_value
     except Exception as e:
         st.error(f"Error processing fallback audio: {e}")
     return None, None, None
 
+def render_audio_status(worker, playing):
+    st.markdown("### Audio Input Status")
+    if not playing:
+        st.markdown("⚫ **Recording Inactive - Press START to begin**")
+        st.progress(0)
+    elif worker.audio_received.is_set():
+        st.markdown("🎤 **Audio Detected and Processing**")
+        st.progress(0.8)
+    else:
+        st.markdown("🔴 **Waiting for Audio Input...**")
+        st.progress(0.1)
+
+def render_history(worker):
+    worker.collect_transcriptions()
+    conversations = st.session_state.conversations
+    if conversations['text']:
+        st.markdown("### Conversation History")
+        history = pd.DataFrame(conversations, columns=CONVERSATION_COLUMNS)
+        st.dataframe(
+            history.style
+                .apply(highlight_risk, subset=['risk_level'])
+                .format({'sentiment_score': '{:.2f}'}),
+            use_container_width=True
+        )
+
+def render_fallback_recorder(speaker):
+    audio_data = st.audio_input("Record audio here (Fallback)")
+    if not audio_data:
+        return False
+    # The recording stays in the widget across reruns; transcribe it only once
+    if audio_data.file_id == st.session_state.fallback_audio_id:
+        return True
+    st.session_state.fallback_audio_id = audio_data.file_id
+    text, risk_level, sentiment_value = process_fallback_audio(audio_data, speaker)
+    if text:
+        st.markdown(f"**Transcribed:** {text}")
+        st.markdown(f"**Sentiment Score:** {sentiment_value:.2f}")
+        if risk_level == "High":
+            st.error("⚠️ High Risk Detected")
+        elif risk_level == "Medium":
+            st.warning("⚠️ Medium Risk Detected")
+        else:
+            st.success("✓ Normal Risk Level")
+    return True
+
 def main():
     st.title("Conversation Transcription & Sentiment Monitor")
     
@@ -101,18 +527,22 @@ def main():
     st.sidebar.header("Controls")
     if st.sidebar.button("Add New Speaker"):
         st.session_state.speaker_count += 1
+        st.session_state.speakers += (f"Person{st.session_state.speaker_count}",)
         st.sidebar.success(f"Added Person{st.session_state.speaker_count}")
+    speaker = st.sidebar.selectbox("Who is speaking?", st.session_state.speakers, key="speaker_sel")
+    fallback_enabled = st.sidebar.toggle("Enable fallback recorder", value=True)
+
+    worker = st.session_state.transcription_worker
+    worker.speaker = speaker
+    worker.ensure_running()
 
     # Audio status container
     audio_status = st.container()
-    with audio_status:
-        st.markdown("### Audio Input Status")
-        status_indicator = st.empty()
-        level_indicator = st.empty()
 
     # Fallback recorder container
     fallback_container = st.container()
     
+    playing = False
     try:
         webrtc_ctx = webrtc_streamer(
             key="speech-to-text",
@@ -121,74 +551,37 @@ def main():
             rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
             media_stream_constraints={"video": False, "audio": True},
             on_change=lambda state: setattr(st.session_state, 'is_recording', state.playing),
-            audio_frame_callback=process_audio
+            audio_frame_callback=worker.process_audio
         )
 
-        if webrtc_ctx.state.playing:
-            if st.session_state.audio_frames_received:
-                status_indicator.markdown("🎤 **Audio Detected and Processing**")
-                level_indicator.progress(0.8)
-            else:
-                status_indicator.markdown("🔴 **Waiting for Audio Input...**")
-                level_indicator.progress(0.1)
-                if not st.session_state.using_fallback:
-                    with fallback_container:
-                        st.warning("WebRTC audio not detected. Using fallback recorder...")
-                        audio_data = st.audio_recorder("Record audio here (Fallback)")
-                        if audio_data:
-                            st.session_state.using_fallback = True
-                            speaker = st.selectbox(
-                                "Who is speaking?",
-                                [f"Person{i+1}" for i in range(st.session_state.speaker_count)]
-                            )
-                            text, risk_level, sentiment_value = process_fallback_audio(audio_data, speaker)
-                            if text:
-                                st.markdown(f"**Transcribed:** {text}")
-                                st.markdown(f"**Sentiment Score:** {sentiment_value:.2f}")
-                                if risk_level == "High":
-                                    st.error("⚠️ High Risk Detected")
-                                elif risk_level == "Medium":
-                                    st.warning("⚠️ Medium Risk Detected")
-                                else:
-                                    st.success("✓ Normal Risk Level")
+        playing = webrtc_ctx.state.playing
+        if playing:
+            if (fallback_enabled and not worker.audio_received.is_set()
+                    and not st.session_state.using_fallback):
+                with fallback_container:
+                    st.warning("WebRTC audio not detected. Using fallback recorder...")
+                    if render_fallback_recorder(speaker):
+                        st.session_state.using_fallback = True
         else:
-            status_indicator.markdown("⚫ **Recording Inactive - Press START to begin**")
-            level_indicator.progress(0)
+            worker.end_stream()
 
     except Exception as e:
         st.error(f"WebRTC Error: {e}")
-        st.warning("Using fallback recorder due to WebRTC error.")
-        with fallback_container:
-            audio_data = st.audio_recorder("Record audio here (Fallback)")
-            if audio_data:
-                speaker = st.selectbox(
-                    "Who is speaking?",
-                    [f"Person{i+1}" for i in range(st.session_state.speaker_count)]
-                )
-                text, risk_level, sentiment_value = process_fallback_audio(audio_data, speaker)
-                if text:
-                    st.markdown(f"**Transcribed:** {text}")
-                    st.markdown(f"**Sentiment Score:** {sentiment_value:.2f}")
-
-    if st.session_state.conversations:
-        st.markdown("### Conversation History")
-        for conv in st.session_state.conversations:
-            col1, col2, col3 = st.columns([3, 1, 1])
-            with col1:
-                st.write(f"**{conv['speaker']}** ({conv['timestamp']}): {conv['text']}")
-            with col2:
-                st.write(f"Sentiment: {conv['sentiment_score']:.2f}")
-            with col3:
-                if conv['risk_level'] == "High":
-                    st.error(f"Risk: {conv['risk_level']}")
-                elif conv['risk_level'] == "Medium":
-                    st.warning(f"Risk: {conv['risk_level']}")
-                else:
-                    st.success(f"Risk: {conv['risk_level']}")
+        if fallback_enabled:
+            st.warning("Using fallback recorder due to WebRTC error.")
+            with fallback_container:
+                render_fallback_recorder(speaker)
+
+    # Only these sections poll the worker while recording, not the whole script
+    refresh = RERUN_INTERVAL if playing else None
+    with audio_status:
+        st.fragment(render_audio_status, run_every=refresh)(worker, playing)
+    st.fragment(render_history, run_every=refresh)(worker)
 
     if st.button("Save Conversation"):
-        if st.session_state.conversations:
-            filename = save_conversation(st.session_state.conversations)
+        conversations = st.session_state.conversations
+        if conversations['text']:
+            filename = save_conversation(conversations)
             st.success(f"✅ Conversation saved to {filename}")
         else:
             st.warning("No conversation to save yet")